@@ -1,7 +1,12 @@
 import streamlit as st
 import pandas as pd
-import altair as alt
+import numpy as np
 import re
+import bisect
+import codecs
+import hashlib
+import os
+import tempfile
 from pathlib import Path
 
 # ============================================================================
@@ -16,28 +21,82 @@ CONGESTION_LEVELS = {
     "매우 혼잡": (100, float('inf'), "#e74c3c", "🔴")
 }
 
+# 등급 조회용 테이블 (CONGESTION_LEVELS 순서와 동일)
+_LEVEL_BOUNDS = [min_val for min_val, _, _, _ in CONGESTION_LEVELS.values()]
+_LEVEL_NAMES = list(CONGESTION_LEVELS.keys())
+_LEVEL_COLORS = [color for _, _, color, _ in CONGESTION_LEVELS.values()]
+_LEVEL_EMOJIS = [emoji for _, _, _, emoji in CONGESTION_LEVELS.values()]
+
+# 벡터 조회용 테이블 (마지막 항목은 NaN/범위 밖 값용, 등급 인덱스 -1로 조회됨)
+_EMOJI_TABLE = np.array(_LEVEL_EMOJIS + ["⚪"], dtype=object)
+_CELL_STYLE_TABLE = np.array([
+    f'background-color: {color}33; color: {color}; font-weight: bold;'
+    for color in _LEVEL_COLORS + ["#95a5a6"]
+], dtype=object)
+
+# 원본 시간 컬럼 패턴 (예: "5시30분")
+_TIME_RE = re.compile(r'(\d+)시(\d+)분')
+
+# 전처리 결과 Parquet 캐시 (데이터 파일 옆 디렉터리)
+PARQUET_CACHE_DIR_NAME = ".cache"
+# 전처리 결과 스키마가 바뀌면 올려서 기존 캐시를 무효화
+PARQUET_CACHE_VERSION = 7
+
 # ============================================================================
 # 유틸리티 함수
 # ============================================================================
 
-def get_congestion_level(congestion: float) -> str:
+def _bucket(congestion: float) -> int:
     """
-    혼잡도 값에 해당하는 등급명을 반환합니다.
+    혼잡도 값이 속한 등급 인덱스를 반환합니다. (범위 밖이면 -1)
+    """
+    # 마지막 등급의 상한(inf)은 포함하지 않음
+    if not np.isfinite(congestion):
+        return -1
+    return bisect.bisect_right(_LEVEL_BOUNDS, congestion) - 1
+
+
+def _bucket_series(congestion: pd.Series) -> np.ndarray:
+    """
+    혼잡도 Series의 등급 인덱스 배열을 반환합니다. (NaN/범위 밖이면 -1)
+    """
+    values = congestion.to_numpy(dtype=float)
+    idx = np.searchsorted(_LEVEL_BOUNDS, values, side='right') - 1
+    idx[~np.isfinite(values)] = -1
+    return idx
+
+
+def get_congestion_bucket(congestion: float) -> tuple:
+    """
+    혼잡도 값에 해당하는 등급명, 색상 코드, 이모지를 한 번에 반환합니다.
     
     Args:
         congestion: 혼잡도 값
         
     Returns:
-        혼잡 등급명 (예: "매우 여유", "보통 혼잡")
+        (등급명, 색상 코드, 이모지) 튜플 (예: ("여유", "#2ecc71", "🟢"))
     """
     if pd.isna(congestion):
-        return "데이터 없음"
+        return ("데이터 없음", "#95a5a6", "⚪")
     
-    for level_name, (min_val, max_val, _, _) in CONGESTION_LEVELS.items():
-        if min_val <= congestion < max_val:
-            return level_name
+    idx = _bucket(congestion)
+    if idx < 0:
+        return ("알 수 없음", "#95a5a6", "⚪")
     
-    return "알 수 없음"
+    return (_LEVEL_NAMES[idx], _LEVEL_COLORS[idx], _LEVEL_EMOJIS[idx])
+
+
+def get_congestion_level(congestion: float) -> str:
+    """
+    혼잡도 값에 해당하는 등급명을 반환합니다.
+    
+    Args:
+        congestion: 혼잡도 값
+        
+    Returns:
+        혼잡 등급명 (예: "매우 여유", "보통 혼잡")
+    """
+    return get_congestion_bucket(congestion)[0]
 
 
 def get_congestion_color(congestion: float) -> str:
@@ -50,14 +109,7 @@ def get_congestion_color(congestion: float) -> str:
     Returns:
         색상 코드 (예: "#3498db")
     """
-    if pd.isna(congestion):
-        return "#95a5a6"  # 회색
-    
-    for level_name, (min_val, max_val, color, _) in CONGESTION_LEVELS.items():
-        if min_val <= congestion < max_val:
-            return color
-    
-    return "#95a5a6"  # 기본 회색
+    return get_congestion_bucket(congestion)[1]
 
 
 def get_congestion_emoji(congestion: float) -> str:
@@ -70,20 +122,83 @@ def get_congestion_emoji(congestion: float) -> str:
     Returns:
         이모지 (예: "🔵", "🟢")
     """
-    if pd.isna(congestion):
-        return "⚪"
+    return get_congestion_bucket(congestion)[2]
+
+
+def get_congestion_emojis(congestion: pd.Series) -> np.ndarray:
+    """
+    혼잡도 Series 전체의 등급 이모지를 한 번에 반환합니다.
     
-    for level_name, (min_val, max_val, _, emoji) in CONGESTION_LEVELS.items():
-        if min_val <= congestion < max_val:
-            return emoji
+    Args:
+        congestion: 혼잡도 Series
+        
+    Returns:
+        이모지 배열 (NaN/범위 밖이면 "⚪")
+    """
+    return _EMOJI_TABLE[_bucket_series(congestion)]
+
+
+def get_congestion_cell_styles(congestion: pd.Series) -> np.ndarray:
+    """
+    혼잡도 Series 전체의 표 셀 스타일(등급 색상)을 한 번에 반환합니다.
     
-    return "⚪"
+    Args:
+        congestion: 혼잡도 Series
+        
+    Returns:
+        CSS 스타일 문자열 배열 (NaN은 빈 문자열)
+    """
+    styles = _CELL_STYLE_TABLE[_bucket_series(congestion)]
+    styles[congestion.isna().to_numpy()] = ''
+    return styles
 
 
 # ============================================================================
 # UI 헬퍼 함수
 # ============================================================================
 
+# KPI 카드 HTML 템플릿 (한 줄로 축약하여 마크다운 페이로드 최소화)
+_KPI_CARD_HTML = (
+    '<div style="padding:20px;border-radius:10px;'
+    'background:linear-gradient(135deg,{color}22 0%,{color}44 100%);'
+    'border-left:5px solid {color};margin-bottom:10px;">'
+    '<p style="margin:0;font-size:14px;color:#666;">{label}</p>'
+    '<p style="margin:5px 0;font-size:32px;font-weight:bold;color:{color};">{emoji} {value}</p>'
+    '<p style="margin:0;font-size:12px;color:#888;">{level}</p>'
+    '</div>'
+)
+
+# 혼잡 등급 범례 카드 HTML 템플릿
+_LEGEND_CARD_HTML = (
+    '<div style="padding:15px;border-radius:8px;background-color:{color}22;'
+    'border:2px solid {color};text-align:center;">'
+    '<div style="font-size:32px;">{emoji}</div>'
+    '<div style="font-weight:bold;color:{color};margin:5px 0;">{level_name}</div>'
+    '<div style="font-size:12px;color:#666;">{range_text}</div>'
+    '</div>'
+)
+
+
+def _build_legend_cards() -> list:
+    """
+    CONGESTION_LEVELS로부터 범례 카드 HTML 목록을 생성합니다.
+    """
+    cards = []
+    for level_name, (min_val, max_val, color, emoji) in CONGESTION_LEVELS.items():
+        max_display = "+" if max_val == float('inf') else str(int(max_val))
+        cards.append(_LEGEND_CARD_HTML.format_map({
+            'color': color,
+            'emoji': emoji,
+            'level_name': level_name,
+            'range_text': f"{int(min_val)}-{max_display}"
+        }))
+    return cards
+
+
+# 범례는 상수로부터만 결정되므로 모듈 로드 시 한 번만 생성
+_LEGEND_CARDS = _build_legend_cards()
+
+
 def render_kpi_with_color(label: str, value: str, congestion: float, help_text: str = None):
     """
     혼잡 등급별 색상이 적용된 KPI 카드를 렌더링합니다.
@@ -94,24 +209,16 @@ def render_kpi_with_color(label: str, value: str, congestion: float, help_text:
         congestion: 혼잡도 (색상 결정용)
         help_text: 도움말 텍스트
     """
-    color = get_congestion_color(congestion)
-    emoji = get_congestion_emoji(congestion)
-    level = get_congestion_level(congestion)
+    level, color, emoji = get_congestion_bucket(congestion)
     
     # HTML 스타일로 색상이 적용된 카드 렌더링
-    st.markdown(f"""
-    <div style="
-        padding: 20px;
-        border-radius: 10px;
-        background: linear-gradient(135deg, {color}22 0%, {color}44 100%);
-        border-left: 5px solid {color};
-        margin-bottom: 10px;
-    ">
-        <p style="margin: 0; font-size: 14px; color: #666;">{label}</p>
-        <p style="margin: 5px 0; font-size: 32px; font-weight: bold; color: {color};">{emoji} {value}</p>
-        <p style="margin: 0; font-size: 12px; color: #888;">{level}</p>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(_KPI_CARD_HTML.format_map({
+        'color': color,
+        'label': label,
+        'emoji': emoji,
+        'value': value,
+        'level': level
+    }), unsafe_allow_html=True)
     
     if help_text:
         st.caption(help_text)
@@ -123,51 +230,59 @@ def render_congestion_legend():
     """
     st.markdown("### 📊 혼잡 등급 안내")
     
-    cols = st.columns(len(CONGESTION_LEVELS))
+    cols = st.columns(len(_LEGEND_CARDS))
     
-    for idx, (level_name, (min_val, max_val, color, emoji)) in enumerate(CONGESTION_LEVELS.items()):
-        with cols[idx]:
-            max_display = "+" if max_val == float('inf') else str(int(max_val))
-            range_text = f"{int(min_val)}-{max_display}"
-            
-            st.markdown(f"""
-            <div style="
-                padding: 15px;
-                border-radius: 8px;
-                background-color: {color}22;
-                border: 2px solid {color};
-                text-align: center;
-            ">
-                <div style="font-size: 32px;">{emoji}</div>
-                <div style="font-weight: bold; color: {color}; margin: 5px 0;">{level_name}</div>
-                <div style="font-size: 12px; color: #666;">{range_text}</div>
-            </div>
-            """, unsafe_allow_html=True)
-
-
-def suggest_alternatives(df: pd.DataFrame, line: str, direction: str):
+    for col, card_html in zip(cols, _LEGEND_CARDS):
+        with col:
+            st.markdown(card_html, unsafe_allow_html=True)
+
+
+def suggest_alternatives(stations_by_line_direction: dict, line: str, direction: str):
     """
     빈 결과일 때 대안을 제안합니다.
     
     Args:
-        df: 전체 데이터프레임
+        stations_by_line_direction: build_filter_index()의 {(호선, 방향): 역명 리스트} 딕셔너리
         line: 선택한 호선
         direction: 선택한 방향
     """
     # 해당 호선의 다른 역 목록
-    available_stations = df[
-        (df['line'] == line) & 
-        (df['direction'] == direction)
-    ]['station_name'].unique()
+    available_stations = stations_by_line_direction.get((line, direction), [])
     
     if len(available_stations) > 0:
-        st.info(f"💡 **{line} {direction} 방향**에서 선택 가능한 역: {', '.join(sorted(available_stations)[:5])} 등 {len(available_stations)}개")
+        st.info(f"💡 **{line} {direction} 방향**에서 선택 가능한 역: {', '.join(available_stations[:5])} 등 {len(available_stations)}개")
 
 
 # ============================================================================
 # 페이즈 1: 데이터 로드 및 전처리
 # ============================================================================
 
+def _sniff_encoding(file_path: str, sample_size: int = 65536) -> str:
+    """
+    파일 앞부분 바이트만 읽어 CSV 인코딩(UTF-8 / CP949)을 판별합니다.
+    
+    Args:
+        file_path: CSV 파일 경로
+        sample_size: 판별에 사용할 바이트 수
+        
+    Returns:
+        pandas에 전달할 인코딩 이름
+    """
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+    
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    
+    try:
+        # 샘플 끝에서 잘린 멀티바이트 문자는 오류로 보지 않음
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return 'cp949'
+    
+    return 'utf-8'
+
+
 @st.cache_data
 def load_raw_data(file_path: str) -> pd.DataFrame:
     """
@@ -179,13 +294,28 @@ def load_raw_data(file_path: str) -> pd.DataFrame:
     Returns:
         원본 DataFrame
     """
-    try:
-        # UTF-8로 먼저 시도
-        df = pd.read_csv(file_path, encoding='utf-8')
-    except UnicodeDecodeError:
-        # CP949로 재시도
-        df = pd.read_csv(file_path, encoding='cp949')
-    
+    # 멀티스레드 pyarrow 파서 사용, 반복되는 ID 컬럼은 바로 category로 읽음
+    read_options = {
+        'engine': 'pyarrow',
+        'dtype': {
+            '요일구분': 'category',
+            '호선': 'category',
+            '출발역': 'category',
+            '상하구분': 'category',
+        },
+    }
+    
+    encoding = _sniff_encoding(file_path)
+    df = pd.read_csv(file_path, encoding=encoding, **read_options)
+
+    # pyarrow는 본문의 잘못된 UTF-8에서 예외 없이 문자열 컬럼을 bytes로 돌려줌
+    # (헤더가 깨진 경우만 UnicodeDecodeError) → 샘플 이후가 CP949면 다시 읽음
+    if encoding != 'cp949' and any(
+        df[col].cat.categories.inferred_type == 'bytes'
+        for col in read_options['dtype']
+    ):
+        df = pd.read_csv(file_path, encoding='cp949', **read_options)
+
     return df
 
 
@@ -202,43 +332,12 @@ def clean_time_slot(time_str: str) -> str:
         정규화된 시간 문자열 (HH:MM)
     """
     # "5시30분" 형태에서 숫자 추출
-    match = re.match(r'(\d+)시(\d+)분', time_str)
+    match = _TIME_RE.match(time_str)
     if match:
-        hour = match.group(1).zfill(2)  # 2자리로 패딩
-        minute = match.group(2).zfill(2)
-        return f"{hour}:{minute}"
+        return f"{int(match.group(1)):02d}:{int(match.group(2)):02d}"
     return time_str
 
 
-def clean_congestion(value) -> float:
-    """
-    혼잡도 값을 정리합니다.
-    
-    - 공백 제거
-    - float 타입 변환
-    - 비정상 값은 NaN 처리
-    
-    Args:
-        value: 원본 혼잡도 값
-        
-    Returns:
-        정리된 float 값
-    """
-    if pd.isna(value):
-        return float('nan')
-    
-    # 문자열인 경우 공백 제거
-    if isinstance(value, str):
-        value = value.strip()
-        if value == '':
-            return float('nan')
-    
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return float('nan')
-
-
 def transform_wide_to_long(df: pd.DataFrame) -> pd.DataFrame:
     """
     와이드 형태의 데이터를 롱 포맷으로 변환합니다.
@@ -249,38 +348,52 @@ def transform_wide_to_long(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         롱 포맷 DataFrame
     """
-    # 기준 컬럼 (ID 변수)
-    id_cols = ['요일구분', '호선', '역번호', '출발역', '상하구분']
-    
-    # 시간 컬럼 (값 변수) - 나머지 모든 컬럼
-    time_cols = [col for col in df.columns if col not in id_cols]
-    
-    # melt로 롱 포맷 변환
-    df_long = pd.melt(
-        df,
-        id_vars=id_cols,
-        value_vars=time_cols,
-        var_name='time_slot',
-        value_name='congestion'
-    )
+    # 기준 컬럼 (ID 변수) - 역번호는 화면에서 쓰지 않으므로 롱 포맷에 복제하지 않음
+    id_cols = ['요일구분', '호선', '출발역', '상하구분']
+    
+    # 시간 컬럼 (값 변수) - "N시M분" 형식 헤더만 사용 (비고 등 알 수 없는 컬럼은 무시)
+    time_cols = [col for col in df.columns if _TIME_RE.fullmatch(str(col))]
+    
+    # 시간대 정규화는 행이 아닌 시간 컬럼 헤더 단위로 한 번만 수행 (예: "5시30분" → "05:30")
+    time_labels = [clean_time_slot(col) for col in time_cols]
+    slot_categories = sorted(set(time_labels))
+    slot_codes = np.array([slot_categories.index(label) for label in time_labels])
+    # 자정 기준 분 단위 정수 (범위 필터용, 예: "07:30" → 450)
+    slot_minutes = np.array([_hm_to_min(label) for label in time_labels], dtype='int16')
+    
+    # 롱 포맷 변환 (pd.melt 대신 연속 배열로 직접 구성, 행 순서: 역 → 시간대)
+    values = df[time_cols].to_numpy()
+    n_rows, n_time_cols = values.shape
+    row_idx = np.repeat(np.arange(n_rows), n_time_cols)
+    col_idx = np.tile(np.arange(n_time_cols), n_rows)
+    df_long = pd.DataFrame({
+        **{col: df[col].array.take(row_idx) for col in id_cols},
+        # 시간대는 범위 비교가 가능하도록 정렬된 순서형 category로 구성
+        'time_slot': pd.Categorical.from_codes(
+            slot_codes[col_idx], categories=slot_categories, ordered=True
+        ),
+        'congestion': values.ravel(),
+        'time_min': slot_minutes[col_idx]
+    })
     
     # 컬럼명 표준화
     df_long = df_long.rename(columns={
         '요일구분': 'day_type',
         '호선': 'line',
-        '역번호': 'station_id',
         '출발역': 'station_name',
         '상하구분': 'direction'
     })
     
-    # 시간대 정규화
-    df_long['time_slot'] = df_long['time_slot'].apply(clean_time_slot)
+    # 혼잡도 정리 (공백 제거 후 float 변환, 비정상 값은 NaN 처리)
+    congestion = df_long['congestion']
+    if congestion.dtype == object:
+        congestion = congestion.astype(str).str.strip()
+    df_long['congestion'] = pd.to_numeric(congestion, errors='coerce')
     
-    # 혼잡도 정리
-    df_long['congestion'] = df_long['congestion'].apply(clean_congestion)
-    
-    # station_id를 int로 변환
-    df_long['station_id'] = pd.to_numeric(df_long['station_id'], errors='coerce').astype('Int64')
+    # 반복되는 문자열 컬럼은 category로 변환 (메모리 절감, 필터/집계 가속)
+    # 사전 필터로 비게 된 카테고리(예: 내선/외선 전용 호선)는 제거
+    for col in ('day_type', 'line', 'direction', 'station_name'):
+        df_long[col] = df_long[col].astype('category').cat.remove_unused_categories()
     
     return df_long
 
@@ -297,31 +410,33 @@ def get_data_quality_report(df: pd.DataFrame) -> dict:
     """
     report = {}
     
+    # 혼잡도 컬럼을 한 번만 읽어 NaN 마스크와 유효값 배열을 재사용
+    congestion = df['congestion'].to_numpy(dtype=float)
+    missing_mask = np.isnan(congestion)
+    valid_congestion = congestion[~missing_mask]
+    
     # 기본 통계
     report['total_records'] = len(df)
-    report['total_missing'] = df['congestion'].isna().sum()
+    report['total_missing'] = int(missing_mask.sum())
     report['missing_pct'] = (report['total_missing'] / report['total_records'] * 100)
     
     # 0.0 값 통계
-    zero_count = (df['congestion'] == 0.0).sum()
+    zero_count = np.count_nonzero(valid_congestion == 0.0)
     report['zero_count'] = zero_count
     report['zero_pct'] = (zero_count / report['total_records'] * 100)
     
     # 혼잡도 통계 (NaN 제외)
-    valid_congestion = df['congestion'].dropna()
     if len(valid_congestion) > 0:
         report['min_congestion'] = valid_congestion.min()
         report['max_congestion'] = valid_congestion.max()
         report['mean_congestion'] = valid_congestion.mean()
-        report['median_congestion'] = valid_congestion.median()
+        report['median_congestion'] = np.median(valid_congestion)
         
         # 이상치 확인 (음수)
-        negative_count = (valid_congestion < 0).sum()
-        report['negative_count'] = negative_count
+        report['negative_count'] = np.count_nonzero(valid_congestion < 0)
         
         # 100 초과 값
-        over_100_count = (valid_congestion > 100).sum()
-        report['over_100_count'] = over_100_count
+        report['over_100_count'] = np.count_nonzero(valid_congestion > 100)
     else:
         report['min_congestion'] = None
         report['max_congestion'] = None
@@ -331,48 +446,274 @@ def get_data_quality_report(df: pd.DataFrame) -> dict:
         report['over_100_count'] = 0
     
     # 유니크 값 통계
-    report['unique_stations'] = df['station_name'].nunique()
-    report['unique_lines'] = df['line'].nunique()
-    report['unique_day_types'] = df['day_type'].nunique()
+    unique_counts = df[['station_name', 'line', 'day_type']].nunique()
+    report['unique_stations'] = unique_counts['station_name']
+    report['unique_lines'] = unique_counts['line']
+    report['unique_day_types'] = unique_counts['day_type']
     
     return report
 
 
+def get_data_version(file_path: str) -> str:
+    """
+    원본 CSV의 데이터 버전 키를 반환합니다.
+    
+    키는 CSV 경로, 수정 시각, 파일 크기, 캐시 버전으로 구성되므로
+    원본 파일이나 전처리 스키마가 바뀌면 새 값이 됩니다.
+    
+    Args:
+        file_path: CSV 파일 경로
+        
+    Returns:
+        16자리 16진수 버전 문자열
+    """
+    csv_path = Path(file_path).resolve()
+    stat = csv_path.stat()
+    key = f"{csv_path}|{stat.st_mtime_ns}|{stat.st_size}|{PARQUET_CACHE_VERSION}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def get_parquet_cache_path(file_path: str, data_version: str) -> Path:
+    """
+    원본 CSV에 대응하는 전처리 결과 Parquet 캐시 경로를 반환합니다.
+    
+    파일명에 데이터 버전이 들어가므로 원본 파일이 바뀌면 자동으로 새 캐시 파일을 사용합니다.
+    
+    Args:
+        file_path: CSV 파일 경로
+        data_version: get_data_version()으로 구한 데이터 버전
+        
+    Returns:
+        Parquet 캐시 파일 경로
+    """
+    csv_path = Path(file_path).resolve()
+    return csv_path.parent / PARQUET_CACHE_DIR_NAME / f"{csv_path.stem}_{data_version}.parquet"
+
+
+def _write_parquet_cache(df: pd.DataFrame, cache_path: Path):
+    """
+    전처리 결과를 Parquet 캐시에 원자적으로 저장하고 같은 CSV의 이전 캐시를 정리합니다.
+    
+    임시 파일에 먼저 쓴 뒤 os.replace로 교체하므로, 저장 중 중단되거나 여러 세션이
+    동시에 저장해도 잘린 파일이 캐시로 읽히지 않습니다. 실패는 무시합니다.
+    
+    Args:
+        df: 저장할 전처리 결과 DataFrame
+        cache_path: get_parquet_cache_path()로 구한 캐시 파일 경로
+    """
+    tmp_path = None
+    try:
+        cache_path.parent.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, prefix=f"{cache_path.stem}.", suffix='.tmp')
+        os.close(fd)
+        df.to_parquet(tmp_path, compression='zstd')
+        os.replace(tmp_path, cache_path)
+        tmp_path = None
+    except (ImportError, OSError, ValueError):
+        if tmp_path is not None:
+            Path(tmp_path).unlink(missing_ok=True)
+        return
+    
+    # 이전 mtime/캐시 버전으로 만든 같은 CSV의 캐시 파일 삭제 (이름: {CSV명}_{16자리 버전}.parquet)
+    csv_stem = cache_path.stem.rsplit('_', 1)[0]
+    for old_path in cache_path.parent.glob(f"{csv_stem}_{'[0-9a-f]' * 16}.parquet"):
+        if old_path != cache_path:
+            try:
+                old_path.unlink()
+            except OSError:
+                pass
+
+
 @st.cache_data
-def load_and_process_data(file_path: str) -> pd.DataFrame:
+def load_and_process_data(file_path: str, data_version: str) -> pd.DataFrame:
     """
     데이터 로드와 전처리를 통합한 함수입니다.
     
+    전처리 결과는 Parquet 파일로도 저장되어, 프로세스가 재시작되어도
+    CSV 파싱과 롱 포맷 변환을 다시 수행하지 않습니다.
+    
     Args:
         file_path: CSV 파일 경로
+        data_version: get_data_version()으로 구한 데이터 버전 (캐시 키)
         
     Returns:
         전처리된 롱 포맷 DataFrame
     """
+    cache_path = get_parquet_cache_path(file_path, data_version)
+    
+    # 0. Parquet 캐시가 있으면 바로 로드
+    if cache_path.exists():
+        try:
+            return pd.read_parquet(cache_path)
+        except (ImportError, OSError, ValueError):
+            # pyarrow 미설치 또는 손상된 캐시 → 원본에서 다시 생성
+            pass
+    
     # 1. 원본 로드
     df_raw = load_raw_data(file_path)
     
-    # 2. 와이드 → 롱 변환 및 정리
+    # 2. 내선/외선 방향 제외 (상행/하행만 유지) - 행 수가 적은 와이드 단계에서 적용
+    df_raw = df_raw[~df_raw['상하구분'].isin(['내선', '외선'])]
+    
+    # 3. 와이드 → 롱 변환 및 정리
     df_processed = transform_wide_to_long(df_raw)
     
-    # 3. 내선/외선 방향 제외 (상행/하행만 유지)
-    df_processed = df_processed[~df_processed['direction'].isin(['내선', '외선'])]
+    # 4. Parquet 캐시 저장 (실패해도 앱 동작에는 영향 없음)
+    _write_parquet_cache(df_processed, cache_path)
     
     return df_processed
 
 
+@st.cache_resource
+def load_indexed_data(file_path: str, data_version: str) -> pd.DataFrame:
+    """
+    (요일구분, 호선, 역명, 방향) 정렬 MultiIndex가 설정된 DataFrame을 생성합니다.
+    
+    파일 경로와 데이터 버전으로 캐싱되므로 재실행 시 DataFrame 해싱 없이 같은 객체를 재사용합니다.
+    반환된 객체는 모든 세션이 공유하므로 수정하지 않아야 합니다.
+    
+    Args:
+        file_path: CSV 파일 경로
+        data_version: get_data_version()으로 구한 데이터 버전 (캐시 키)
+        
+    Returns:
+        정렬된 MultiIndex DataFrame
+    """
+    df = load_and_process_data(file_path, data_version)
+    return df.set_index(['day_type', 'line', 'station_name', 'direction']).sort_index()
+
+
+@st.cache_resource
+def load_line_aggregates(file_path: str, data_version: str) -> pd.DataFrame:
+    """
+    (요일구분, 호선, 방향, 시간대)별 평균 혼잡도 집계 테이블을 생성합니다.
+    
+    호선별 비교는 이 작은 테이블만 조회하므로 실행마다 전체 역을 다시 집계하지 않습니다.
+    반환된 객체는 모든 세션이 공유하므로 수정하지 않아야 합니다.
+    
+    Args:
+        file_path: CSV 파일 경로
+        data_version: get_data_version()으로 구한 데이터 버전 (캐시 키)
+        
+    Returns:
+        day_type, line, direction, time_slot, time_min, congestion(평균), records(원본 레코드 수)
+        컬럼의 DataFrame
+    """
+    df = load_and_process_data(file_path, data_version)
+    return df.groupby(
+        ['day_type', 'line', 'direction', 'time_slot', 'time_min'], as_index=False, observed=True, sort=False
+    ).agg(congestion=('congestion', 'mean'), records=('congestion', 'size'))
+
+
+# indexed_df의 내용은 함께 넘기는 data_version이 식별하므로 프레임 자체는 해싱하지 않는
+# 캐시 데코레이터 (메모리 주소가 아닌 데이터 버전이 캐시 키가 됨)
+_cache_by_data_version = st.cache_data(
+    hash_funcs={pd.DataFrame: lambda _: None}, max_entries=64, show_spinner=False
+)
+
+
+@_cache_by_data_version
+def build_filter_index(indexed_df: pd.DataFrame, data_version: str) -> dict:
+    """
+    사이드바 필터 선택지를 한 번에 계산합니다.
+    
+    Args:
+        indexed_df: load_indexed_data()로 만든 MultiIndex DataFrame
+        data_version: indexed_df를 만든 데이터 버전 (캐시 키)
+        
+    Returns:
+        day_types, lines, directions, time_slots 정렬 리스트와
+        stations_by_line {호선: 정렬된 역명 리스트},
+        stations_by_line_direction {(호선, 방향): 정렬된 역명 리스트} 딕셔너리
+    """
+    levels = indexed_df.index.to_frame(index=False)
+    stations = levels.groupby('line', observed=True)['station_name'].unique()
+    stations_by_dir = levels.groupby(['line', 'direction'], observed=True)['station_name'].unique()
+    
+    return {
+        'day_types': sorted(levels['day_type'].unique().tolist()),
+        'lines': sorted(levels['line'].unique().tolist()),
+        'stations_by_line': {line: sorted(names) for line, names in stations.items()},
+        'stations_by_line_direction': {key: sorted(names) for key, names in stations_by_dir.items()},
+        'directions': sorted(levels['direction'].unique().tolist()),
+        'time_slots': sorted(indexed_df['time_slot'].unique().tolist())
+    }
+
+
 # ============================================================================
 # 페이즈 2: 필터 및 집계 함수
 # ============================================================================
 
-@st.cache_data
-def filter_data(df: pd.DataFrame, day_type: str, line: str, station: str, 
+def _equals_mask(column: pd.Series, value) -> np.ndarray:
+    """
+    category 컬럼의 코드 배열에서 값과 일치하는 행의 마스크를 만듭니다.
+    """
+    codes = column.cat.codes.to_numpy()
+    try:
+        code = column.cat.categories.get_loc(value)
+    except KeyError:
+        return np.zeros(len(codes), dtype=bool)
+    return codes == code
+
+
+def _isin_mask(column: pd.Series, values) -> np.ndarray:
+    """
+    category 컬럼의 코드 배열에서 값 목록에 포함되는 행의 마스크를 만듭니다.
+    """
+    categories = column.cat.categories
+    value_codes = [categories.get_loc(v) for v in values if v in categories]
+    return np.isin(column.cat.codes.to_numpy(), value_codes)
+
+
+def _hm_to_min(time_str: str) -> int:
+    """
+    "HH:MM" 문자열을 자정 기준 분 단위 정수로 변환합니다.
+    """
+    hour, minute = time_str.split(':')
+    return int(hour) * 60 + int(minute)
+
+
+def _time_range_mask(column: pd.Series, start_time: str, end_time: str) -> np.ndarray:
+    """
+    time_min 컬럼에서 [start_time, end_time] 범위에 속하는 행의 마스크를 만듭니다.
+    """
+    minutes = column.to_numpy()
+    return (minutes >= _hm_to_min(start_time)) & (minutes <= _hm_to_min(end_time))
+
+
+def _top_n_positions(values: np.ndarray, n: int) -> np.ndarray:
+    """
+    값이 큰 순서대로 상위 n개 위치를 반환합니다 (NaN 제외, 동점은 항상 앞선 행 우선).
+    
+    전체 정렬 대신 np.partition으로 n번째 값을 찾고 후보만 정렬합니다.
+    """
+    valid = np.flatnonzero(~np.isnan(values))
+    k = min(n, len(valid))
+    if k == 0:
+        return valid
+    
+    # n번째 큰 값 이상인 후보만 (-값, 원래 위치) 순으로 안정 정렬
+    # (nlargest는 n이 행 수 이상이면 불안정 정렬로 바뀌어 동점 순서가 다를 수 있음)
+    kth = np.partition(values[valid], len(valid) - k)[len(valid) - k]
+    candidates = valid[values[valid] >= kth]
+    order = np.argsort(-values[candidates], kind='stable')[:k]
+    
+    return candidates[order]
+
+
+# filter_data 결과 컬럼 (KPI, 차트, TOP 테이블이 읽는 컬럼만 유지)
+FILTER_RESULT_COLUMNS = ['time_slot', 'station_name', 'line', 'direction', 'congestion']
+
+
+@_cache_by_data_version
+def filter_data(indexed_df: pd.DataFrame, data_version: str, day_type: str, line: str, station: str, 
                 direction: str, start_time: str, end_time: str) -> pd.DataFrame:
     """
     필터 조건에 따라 데이터를 필터링합니다.
     
     Args:
-        df: 전처리된 DataFrame
+        indexed_df: load_indexed_data()로 만든 MultiIndex DataFrame
+        data_version: indexed_df를 만든 데이터 버전 (캐시 키)
         day_type: 요일구분
         line: 호선
         station: 역명
@@ -383,19 +724,20 @@ def filter_data(df: pd.DataFrame, day_type: str, line: str, station: str,
     Returns:
         필터링된 DataFrame
     """
-    filtered = df[
-        (df['day_type'] == day_type) &
-        (df['line'] == line) &
-        (df['station_name'] == station) &
-        (df['direction'] == direction) &
-        (df['time_slot'] >= start_time) &
-        (df['time_slot'] <= end_time)
-    ].copy()
+    # 정렬된 인덱스에서 (요일, 호선, 역, 방향) 구간만 바로 조회
+    try:
+        sliced = indexed_df.xs((day_type, line, station, direction), drop_level=False)
+    except KeyError:
+        return indexed_df.iloc[:0].reset_index()[FILTER_RESULT_COLUMNS]
+    
+    # 작은 결과에만 시간대 범위 적용, 화면에서 쓰는 컬럼만 반환
+    filtered = sliced[_time_range_mask(sliced['time_min'], start_time, end_time)].reset_index()
+    filtered = filtered[FILTER_RESULT_COLUMNS]
     
     return filtered
 
 
-@st.cache_data
+@st.cache_data(max_entries=64, show_spinner=False)
 def calculate_kpis(filtered_df: pd.DataFrame) -> dict:
     """
     KPI 지표를 계산합니다.
@@ -408,14 +750,18 @@ def calculate_kpis(filtered_df: pd.DataFrame) -> dict:
     """
     kpis = {}
     
-    # NaN 제외한 데이터
-    valid_data = filtered_df.dropna(subset=['congestion'])
-    
-    if len(valid_data) > 0:
-        kpis['max_congestion'] = valid_data['congestion'].max()
-        max_idx = valid_data['congestion'].idxmax()
-        kpis['peak_time'] = valid_data.loc[max_idx, 'time_slot']
-        kpis['avg_congestion'] = valid_data['congestion'].mean()
+    # NaN 마스크를 한 번만 만들고 유효값 배열에서 최대/위치/평균을 함께 계산
+    congestion = filtered_df['congestion'].to_numpy()
+    valid_pos = np.flatnonzero(~np.isnan(congestion))
+    
+    if len(valid_pos) > 0:
+        valid = congestion[valid_pos]
+        max_idx = int(valid.argmax())
+        kpis['max_congestion'] = float(valid[max_idx])
+        # 피크 시간대는 category 코드로 바로 조회
+        time_slot = filtered_df['time_slot'].cat
+        kpis['peak_time'] = time_slot.categories[time_slot.codes.iat[valid_pos[max_idx]]]
+        kpis['avg_congestion'] = float(valid.mean())
     else:
         kpis['max_congestion'] = 0.0
         kpis['peak_time'] = 'N/A'
@@ -435,14 +781,15 @@ TIME_PRESETS = {
 }
 
 
-@st.cache_data
-def filter_for_direction_compare(df: pd.DataFrame, day_type: str, line: str, 
+@_cache_by_data_version
+def filter_for_direction_compare(indexed_df: pd.DataFrame, data_version: str, day_type: str, line: str, 
                                   station: str, start_time: str, end_time: str) -> pd.DataFrame:
     """
     양방향 데이터를 필터링합니다 (방향 비교용).
     
     Args:
-        df: 전처리된 DataFrame
+        indexed_df: load_indexed_data()로 만든 MultiIndex DataFrame
+        data_version: indexed_df를 만든 데이터 버전 (캐시 키)
         day_type: 요일구분
         line: 호선
         station: 역명
@@ -452,25 +799,24 @@ def filter_for_direction_compare(df: pd.DataFrame, day_type: str, line: str,
     Returns:
         양방향 데이터가 포함된 필터링된 DataFrame
     """
-    filtered = df[
-        (df['day_type'] == day_type) &
-        (df['line'] == line) &
-        (df['station_name'] == station) &
-        (df['time_slot'] >= start_time) &
-        (df['time_slot'] <= end_time)
-    ].copy()
+    # (요일, 호선, 역) 인덱스 접두어로 양방향을 한 번에 조회
+    try:
+        sliced = indexed_df.xs((day_type, line, station), drop_level=False)
+    except KeyError:
+        return indexed_df.iloc[:0].reset_index()
+    
+    filtered = sliced[_time_range_mask(sliced['time_min'], start_time, end_time)].reset_index()
     
     return filtered
 
 
-@st.cache_data
-def filter_for_line_compare(df: pd.DataFrame, day_type: str, lines: tuple, 
+def filter_for_line_compare(line_agg: pd.DataFrame, day_type: str, lines: tuple, 
                             direction: str, start_time: str, end_time: str) -> pd.DataFrame:
     """
-    다중 호선 데이터를 필터링합니다 (호선별 비교용).
+    다중 호선 집계 데이터를 필터링합니다 (호선별 비교용).
     
     Args:
-        df: 전처리된 DataFrame
+        line_agg: load_line_aggregates()로 만든 호선별 평균 집계 테이블
         day_type: 요일구분
         lines: 호선 튜플 (캐싱을 위해 tuple 사용)
         direction: 방향
@@ -478,137 +824,288 @@ def filter_for_line_compare(df: pd.DataFrame, day_type: str, lines: tuple,
         end_time: 종료 시간
         
     Returns:
-        다중 호선 데이터가 포함된 필터링된 DataFrame
+        선택한 호선의 시간대별 평균 혼잡도 DataFrame (records: 집계된 원본 레코드 수)
     """
-    filtered = df[
-        (df['day_type'] == day_type) &
-        (df['line'].isin(lines)) &
-        (df['direction'] == direction) &
-        (df['time_slot'] >= start_time) &
-        (df['time_slot'] <= end_time)
-    ].copy()
+    # 하나의 마스크에 제자리 AND로 누적 (중간 불리언 배열 할당 최소화)
+    mask = _equals_mask(line_agg['day_type'], day_type)
+    mask &= _isin_mask(line_agg['line'], lines)
+    mask &= _equals_mask(line_agg['direction'], direction)
+    mask &= _time_range_mask(line_agg['time_min'], start_time, end_time)
+    filtered = line_agg.iloc[np.flatnonzero(mask)]
     
     return filtered
 
 
-def create_direction_compare_chart(df: pd.DataFrame, time_slots: list, 
-                                   station: str, day_type: str) -> alt.Chart:
+# 혼잡 등급 기준선 (별도 DataFrame 없이 차트 스펙에 인라인 값으로 포함)
+REFERENCE_LINES_DATA = {'values': [
+    {'threshold': 30, 'label': '여유 기준'},
+    {'threshold': 60, 'label': '보통 혼잡 기준'},
+    {'threshold': 100, 'label': '매우 혼잡 기준'},
+]}
+
+
+def create_reference_rule_layer() -> dict:
+    """
+    비교 차트용 혼잡 등급 기준선(회색 점선) 레이어를 생성합니다.
+    
+    Returns:
+        Vega-Lite 레이어 스펙 딕셔너리
+    """
+    return {
+        'data': REFERENCE_LINES_DATA,
+        'mark': {'type': 'rule', 'strokeDash': [5, 5], 'opacity': 0.3, 'color': 'gray'},
+        'encoding': {
+            'y': {'field': 'threshold', 'type': 'quantitative'},
+            'size': {'value': 1}
+        }
+    }
+
+
+def create_congestion_line_layer(df: pd.DataFrame, y_title: str, series_field: str = None,
+                                 series_title: str = None, color: str = None) -> dict:
+    """
+    시간대별 혼잡도 라인 레이어 스펙을 생성합니다.
+    
+    Args:
+        df: time_slot, congestion (및 series_field) 컬럼을 가진 차트 데이터
+        y_title: Y축 제목
+        series_field: 계열 구분 컬럼 (없으면 단일 라인)
+        series_title: 계열 범례 제목
+        color: 단일 라인 색상
+        
+    Returns:
+        Vega-Lite 레이어 스펙 딕셔너리
+    """
+    mark = {'type': 'line', 'point': True, 'strokeWidth': 3}
+    if color is not None:
+        mark['color'] = color
+    
+    # time_slot은 "HH:MM" 문자열이라 ordinal 기본 정렬이 시간 순서와 같음
+    encoding = {
+        'x': {'field': 'time_slot', 'type': 'ordinal', 'title': '시간대',
+              'axis': {'labelAngle': -45}},
+        'y': {'field': 'congestion', 'type': 'quantitative', 'title': y_title,
+              'scale': {'domain': [0, float(max(df['congestion'].max() * 1.1, 120))]}},
+        'tooltip': [
+            {'field': 'time_slot', 'type': 'nominal', 'title': '시간대'},
+            {'field': 'congestion', 'type': 'quantitative', 'title': y_title, 'format': '.1f'}
+        ]
+    }
+    if series_field is not None:
+        encoding['color'] = {'field': series_field, 'type': 'nominal', 'title': series_title,
+                             'scale': {'scheme': 'category10'}}
+        encoding['tooltip'].insert(0, {'field': series_field, 'type': 'nominal', 'title': series_title})
+    
+    return {'mark': mark, 'encoding': encoding}
+
+
+def create_direction_compare_chart(df: pd.DataFrame, station: str, day_type: str) -> dict:
     """
     방향 비교 멀티라인 차트를 생성합니다 (기준선 포함).
     
     Args:
         df: 양방향 데이터 DataFrame
-        time_slots: 전체 시간대 리스트
         station: 역명
         day_type: 요일구분
         
     Returns:
-        Altair 차트 객체
+        Vega-Lite 차트 스펙 딕셔너리
     """
-    # NaN 제외
-    chart_data = df.dropna(subset=['congestion'])
+    # NaN 제외 + 차트 인코딩에 쓰는 컬럼만 전송
+    chart_data = df.loc[df['congestion'].notna(), ['time_slot', 'direction', 'congestion']]
     
     if len(chart_data) == 0:
         return None
     
-    # 기본 멀티라인 차트
-    line_chart = alt.Chart(chart_data).mark_line(point=True, strokeWidth=3).encode(
-        x=alt.X('time_slot:N', 
-                title='시간대',
-                sort=time_slots,
-                axis=alt.Axis(labelAngle=-45)),
-        y=alt.Y('congestion:Q', 
-                title='혼잡도',
-                scale=alt.Scale(domain=[0, max(chart_data['congestion'].max() * 1.1, 120)])),
-        color=alt.Color('direction:N', 
-                       title='방향',
-                       scale=alt.Scale(scheme='category10')),
-        tooltip=[
-            alt.Tooltip('direction:N', title='방향'),
-            alt.Tooltip('time_slot:N', title='시간대'),
-            alt.Tooltip('congestion:Q', title='혼잡도', format='.1f')
+    # 방향별 멀티라인 + 혼잡 등급 기준선
+    return {
+        'title': f"{station} 방향별 비교 - {day_type}",
+        'height': 400,
+        'data': {'values': chart_data},
+        'layer': [
+            create_congestion_line_layer(chart_data, '혼잡도', 'direction', '방향'),
+            create_reference_rule_layer()
         ]
-    )
-    
-    # 혼잡 등급 기준선 추가
-    reference_lines = pd.DataFrame({
-        'threshold': [30, 60, 100],
-        'label': ['여유 기준', '보통 혼잡 기준', '매우 혼잡 기준']
-    })
-    
-    rule_chart = alt.Chart(reference_lines).mark_rule(strokeDash=[5, 5], opacity=0.3, color='gray').encode(
-        y='threshold:Q',
-        size=alt.value(1)
-    )
-    
-    # 차트 합성
-    chart = (line_chart + rule_chart).properties(
-        title=f"{station} 방향별 비교 - {day_type}",
-        height=400
-    )
-    
-    return chart
+    }
 
 
-def create_line_compare_chart(df: pd.DataFrame, time_slots: list, 
-                              direction: str, day_type: str) -> alt.Chart:
+def create_line_compare_chart(df: pd.DataFrame, direction: str, day_type: str) -> dict:
     """
     호선별 비교 멀티라인 차트를 생성합니다 (기준선 포함).
     
     Args:
-        df: 다중 호선 데이터 DataFrame
-        time_slots: 전체 시간대 리스트
+        df: filter_for_line_compare()로 조회한 호선별 평균 DataFrame
         direction: 방향
         day_type: 요일구분
         
     Returns:
-        Altair 차트 객체
+        Vega-Lite 차트 스펙 딕셔너리
     """
-    # NaN 제외하고 시간대별 호선별 평균 계산
-    chart_data = df.dropna(subset=['congestion']).groupby(
-        ['line', 'time_slot'], as_index=False
-    )['congestion'].mean()
+    # 전부 NaN인 시간대 제외 + 차트 인코딩에 쓰는 컬럼만 전송
+    chart_data = df.loc[df['congestion'].notna(), ['line', 'time_slot', 'congestion']]
     
     if len(chart_data) == 0:
         return None
     
-    # 기본 멀티라인 차트
-    line_chart = alt.Chart(chart_data).mark_line(point=True, strokeWidth=3).encode(
-        x=alt.X('time_slot:N', 
-                title='시간대',
-                sort=time_slots,
-                axis=alt.Axis(labelAngle=-45)),
-        y=alt.Y('congestion:Q', 
-                title='평균 혼잡도',
-                scale=alt.Scale(domain=[0, max(chart_data['congestion'].max() * 1.1, 120)])),
-        color=alt.Color('line:N', 
-                       title='호선',
-                       scale=alt.Scale(scheme='category10')),
-        tooltip=[
-            alt.Tooltip('line:N', title='호선'),
-            alt.Tooltip('time_slot:N', title='시간대'),
-            alt.Tooltip('congestion:Q', title='평균 혼잡도', format='.1f')
+    # 호선별 멀티라인 + 혼잡 등급 기준선
+    return {
+        'title': f"호선별 평균 혼잡도 비교 ({direction}) - {day_type}",
+        'height': 400,
+        'data': {'values': chart_data},
+        'layer': [
+            create_congestion_line_layer(chart_data, '평균 혼잡도', 'line', '호선'),
+            create_reference_rule_layer()
         ]
-    )
+    }
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_top_congestion(filtered_df: pd.DataFrame, top_criteria: str, top_n: int,
+                       specific_time: str = None) -> pd.DataFrame:
+    """
+    선택한 정렬 기준으로 혼잡 TOP N 구간을 계산합니다.
     
-    # 혼잡 등급 기준선 추가
-    reference_lines = pd.DataFrame({
-        'threshold': [30, 60, 100],
-        'label': ['여유 기준', '보통 혼잡 기준', '매우 혼잡 기준']
-    })
+    Args:
+        filtered_df: 필터링된 DataFrame
+        top_criteria: 정렬 기준 ("피크 (최대)", "평균", "특정 시간대")
+        top_n: 상위 구간 수
+        specific_time: "특정 시간대" 기준일 때의 시간대
+        
+    Returns:
+        time_slot, station_name, line, direction, congestion 컬럼의 TOP N DataFrame
+    """
+    if top_criteria == "피크 (최대)":
+        # 기존 방식: 각 시간대별 최대값
+        positions = _top_n_positions(filtered_df['congestion'].to_numpy(dtype=float), top_n)
+        top_df = filtered_df.iloc[positions][
+            ['time_slot', 'station_name', 'line', 'direction', 'congestion']
+        ].reset_index(drop=True)
     
-    rule_chart = alt.Chart(reference_lines).mark_rule(strokeDash=[5, 5], opacity=0.3, color='gray').encode(
-        y='threshold:Q',
-        size=alt.value(1)
-    )
+    elif top_criteria == "평균":
+        # 역/방향별 평균 혼잡도로 정렬
+        avg_df = filtered_df.dropna(subset=['congestion']).groupby(
+            ['station_name', 'line', 'direction'], as_index=False, observed=True, sort=False
+        )['congestion'].mean()
+        avg_df = avg_df.rename(columns={'congestion': 'avg_congestion'})
+        positions = _top_n_positions(avg_df['avg_congestion'].to_numpy(dtype=float), top_n)
+        top_df = avg_df.iloc[positions][
+            ['station_name', 'line', 'direction', 'avg_congestion']
+        ].reset_index(drop=True)
+        top_df = top_df.rename(columns={'avg_congestion': 'congestion'})
+        top_df.insert(1, 'time_slot', '평균')
+    
+    else:  # 특정 시간대
+        # 특정 시간대의 혼잡도로 정렬
+        time_specific_df = filtered_df[filtered_df['time_slot'] == specific_time]
+        positions = _top_n_positions(time_specific_df['congestion'].to_numpy(dtype=float), top_n)
+        top_df = time_specific_df.iloc[positions][
+            ['time_slot', 'station_name', 'line', 'direction', 'congestion']
+        ].reset_index(drop=True)
+    
+    return top_df
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def encode_csv(df: pd.DataFrame) -> bytes:
+    """
+    다운로드용 CSV 바이트를 생성합니다 (엑셀 호환 UTF-8 BOM).
+    
+    Args:
+        df: 내보낼 DataFrame
+        
+    Returns:
+        utf-8-sig로 인코딩된 CSV 바이트
+    """
+    return df.to_csv(index=False).encode('utf-8-sig')
+
+
+@st.fragment
+def render_top_congestion_table(filtered_df: pd.DataFrame, time_slots: list,
+                                selected_station: str, selected_day: str):
+    """
+    혼잡 TOP 10 구간 테이블과 CSV 다운로드 버튼을 렌더링합니다.
     
-    # 차트 합성
-    chart = (line_chart + rule_chart).properties(
-        title=f"호선별 평균 혼잡도 비교 ({direction}) - {day_type}",
-        height=400
+    fragment로 분리되어 정렬 기준/시간대를 바꿀 때 이 영역만 다시 실행됩니다.
+    
+    Args:
+        filtered_df: 필터링된 DataFrame
+        time_slots: 시간대 선택지 목록
+        selected_station: 선택한 역명 (다운로드 파일명용)
+        selected_day: 선택한 요일구분 (다운로드 파일명용)
+    """
+    st.markdown("### 🔝 혼잡 TOP 10 구간")
+    
+    # TOP N 정렬 기준 선택
+    col_top1, col_top2 = st.columns([2, 1])
+    
+    with col_top1:
+        top_criteria = st.radio(
+            "정렬 기준",
+            options=["피크 (최대)", "평균", "특정 시간대"],
+            horizontal=True,
+            help="혼잡 TOP 구간을 선택한 기준으로 정렬합니다."
+        )
+    
+    with col_top2:
+        if top_criteria == "특정 시간대":
+            specific_time = st.selectbox(
+                "시간대 선택",
+                options=time_slots,
+                index=time_slots.index("08:00") if "08:00" in time_slots else 0
+            )
+    
+    # 혼잡 TOP 10 구간 계산
+    top_n = 10
+    
+    top_df = get_top_congestion(
+        filtered_df,
+        top_criteria,
+        top_n,
+        specific_time if top_criteria == "특정 시간대" else None
     )
     
-    return chart
+    # 빈 결과 처리
+    if len(top_df) == 0:
+        st.info("선택한 조건에 해당하는 혼잡 데이터가 없습니다.")
+    else:
+        # 순위 추가
+        top_df.insert(0, '순위', range(1, len(top_df) + 1))
+        
+        # 혼잡 등급 및 이모지 추가
+        top_df['혼잡등급'] = get_congestion_emojis(top_df['congestion'])
+        
+        # 컬럼명 한글화
+        top_df_display = top_df.rename(columns={
+            '순위': '순위',
+            'time_slot': '시간대',
+            'station_name': '역명',
+            'line': '호선',
+            'direction': '방향',
+            'congestion': '혼잡도',
+            '혼잡등급': '등급'
+        })
+        
+        # 혼잡도 컬럼 전체에 등급 색상 스타일 적용
+        styled_df = top_df_display.style.apply(
+            get_congestion_cell_styles,
+            subset=['혼잡도']
+        )
+        
+        st.dataframe(
+            styled_df,
+            use_container_width=True,
+            hide_index=True
+        )
+        
+        # CSV 다운로드 버튼
+        csv = encode_csv(top_df_display)
+        st.download_button(
+            label="📥 CSV 다운로드",
+            data=csv,
+            file_name=f"혼잡도_TOP{top_n}_{selected_station}_{selected_day}.csv",
+            mime="text/csv",
+            help="상위 혼잡 구간 데이터를 CSV 파일로 다운로드합니다."
+        )
 
 
 # ============================================================================
@@ -671,32 +1168,35 @@ def main():
     
     # 데이터 로드 및 전처리
     with st.spinner("데이터를 로드하고 전처리 중입니다..."):
-        df = load_and_process_data(data_file)
+        data_version = get_data_version(data_file)
+        indexed_df = load_indexed_data(data_file, data_version)
+        line_agg = load_line_aggregates(data_file, data_version)
     
     # ========================================================================
     # Sidebar 필터
     # ========================================================================
     with st.sidebar:
         st.header("🔍 필터")
+        filter_index = build_filter_index(indexed_df, data_version)
         
         # 요일구분
-        day_types = sorted(df['day_type'].unique().tolist())
+        day_types = filter_index['day_types']
         selected_day = st.selectbox("요일구분", day_types, index=0)
         
         # 호선
-        lines = sorted(df['line'].unique().tolist())
+        lines = filter_index['lines']
         selected_line = st.selectbox("호선", lines, index=0)
         
         # 역 선택 (해당 호선만 필터링)
-        stations_in_line = df[df['line'] == selected_line]['station_name'].unique().tolist()
-        selected_station = st.selectbox("역", sorted(stations_in_line), index=0)
+        stations_in_line = filter_index['stations_by_line'][selected_line]
+        selected_station = st.selectbox("역", stations_in_line, index=0)
         
         # 방향
-        directions = sorted(df['direction'].unique().tolist())
+        directions = filter_index['directions']
         selected_direction = st.selectbox("방향", directions, index=0)
         
         # 시간대 범위
-        time_slots = sorted(df['time_slot'].unique().tolist())
+        time_slots = filter_index['time_slots']
         
         st.markdown("**⏰ 시간대 프리셋**")
         col_preset1, col_preset2, col_preset3 = st.columns(3)
@@ -738,13 +1238,14 @@ def main():
         )
         
         st.markdown("---")
-        st.caption(f"총 {len(df):,}개 레코드")
+        st.caption(f"총 {len(indexed_df):,}개 레코드")
     
     # ========================================================================
     # 필터 적용
     # ========================================================================
     filtered_df = filter_data(
-        df, 
+        indexed_df, 
+        data_version,
         selected_day, 
         selected_line, 
         selected_station, 
@@ -759,7 +1260,7 @@ def main():
         st.info("💡 **대안 제안**: 시간대 범위를 넓히거나 다른 역/호선을 선택해보세요.")
         
         # 대안 제안
-        suggest_alternatives(df, selected_line, selected_direction)
+        suggest_alternatives(filter_index['stations_by_line_direction'], selected_line, selected_direction)
         
         # 추가 팁
         with st.expander("📌 문제 해결 팁"):
@@ -799,19 +1300,13 @@ def main():
     
     with col2:
         # 피크 시간대는 색상 없이 표시
-        st.markdown(f"""
-        <div style="
-            padding: 20px;
-            border-radius: 10px;
-            background: linear-gradient(135deg, #95a5a622 0%, #95a5a644 100%);
-            border-left: 5px solid #95a5a6;
-            margin-bottom: 10px;
-        ">
-            <p style="margin: 0; font-size: 14px; color: #666;">피크 시간대</p>
-            <p style="margin: 5px 0; font-size: 32px; font-weight: bold; color: #95a5a6;">⏰ {kpis['peak_time']}</p>
-            <p style="margin: 0; font-size: 12px; color: #888;">최대 혼잡도 발생 시각</p>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(_KPI_CARD_HTML.format_map({
+            'color': '#95a5a6',
+            'label': '피크 시간대',
+            'emoji': '⏰',
+            'value': kpis['peak_time'],
+            'level': '최대 혼잡도 발생 시각'
+        }), unsafe_allow_html=True)
         st.caption("최대 혼잡도가 발생한 시간")
     
     with col3:
@@ -833,49 +1328,38 @@ def main():
     if len(filtered_df) > 10000:
         st.warning(f"⚠️ 대용량 데이터 ({len(filtered_df):,}개 레코드) - 차트 생성에 시간이 걸릴 수 있습니다.")
     
-    # NaN 제외한 데이터로 차트 생성
-    chart_data = filtered_df.dropna(subset=['congestion'])
+    # NaN 제외 + 차트 인코딩에 쓰는 컬럼만 전송
+    chart_data = filtered_df.loc[filtered_df['congestion'].notna(), ['time_slot', 'congestion']]
     
     if len(chart_data) > 0:
         with st.spinner("📊 차트를 생성하는 중..."):
-            # 기본 라인 차트
-            line_chart = alt.Chart(chart_data).mark_line(point=True, strokeWidth=3, color='#1f77b4').encode(
-                x=alt.X('time_slot:N', 
-                        title='시간대',
-                        sort=time_slots,
-                        axis=alt.Axis(labelAngle=-45)),
-                y=alt.Y('congestion:Q', 
-                        title='혼잡도',
-                        scale=alt.Scale(domain=[0, max(chart_data['congestion'].max() * 1.1, 120)])),
-                tooltip=[
-                    alt.Tooltip('time_slot:N', title='시간대'),
-                    alt.Tooltip('congestion:Q', title='혼잡도', format='.1f')
+            # 라인 + 색상별 혼잡 등급 기준선
+            final_chart = {
+                'title': f"{selected_station} ({selected_direction}) - {selected_day}",
+                'height': 400,
+                'data': {'values': chart_data},
+                'layer': [
+                    create_congestion_line_layer(chart_data, '혼잡도', color='#1f77b4'),
+                    {
+                        'data': REFERENCE_LINES_DATA,
+                        'mark': {'type': 'rule', 'strokeDash': [5, 5], 'opacity': 0.5},
+                        'encoding': {
+                            'y': {'field': 'threshold', 'type': 'quantitative'},
+                            'color': {
+                                'field': 'label', 'type': 'nominal',
+                                'scale': {
+                                    'domain': ['여유 기준', '보통 혼잡 기준', '매우 혼잡 기준'],
+                                    'range': ['#2ecc71', '#f1c40f', '#e74c3c']
+                                },
+                                'legend': {'title': '기준선'}
+                            },
+                            'size': {'value': 2}
+                        }
+                    }
                 ]
-            )
-            
-            # 혼잡 등급 기준선 추가
-            reference_lines = pd.DataFrame({
-                'threshold': [30, 60, 100],
-                'label': ['여유 기준', '보통 혼잡 기준', '매우 혼잡 기준'],
-                'color': ['#2ecc71', '#f1c40f', '#e74c3c']
-            })
-            
-            rule_chart = alt.Chart(reference_lines).mark_rule(strokeDash=[5, 5], opacity=0.5).encode(
-                y='threshold:Q',
-                color=alt.Color('label:N', scale=alt.Scale(
-                    domain=['여유 기준', '보통 혼잡 기준', '매우 혼잡 기준'],
-                    range=['#2ecc71', '#f1c40f', '#e74c3c']
-                ), legend=alt.Legend(title='기준선')),
-                size=alt.value(2)
-            )
-            
-            # 차트 합성
-            final_chart = (line_chart + rule_chart).properties(
-                title=f"{selected_station} ({selected_direction}) - {selected_day}",
-                height=400
-            )
+            }
             
-            st.altair_chart(final_chart, use_container_width=True)
+            st.vega_lite_chart(final_chart, use_container_width=True)
         
         # 안내 캡션
         col_caption1, col_caption2 = st.columns(2)
@@ -901,7 +1385,8 @@ def main():
     # 양방향 데이터 필터링
     with st.spinner("🔄 방향별 데이터를 비교하는 중..."):
         direction_compare_df = filter_for_direction_compare(
-            df, 
+            indexed_df, 
+            data_version,
             selected_day, 
             selected_line, 
             selected_station,
@@ -913,13 +1398,12 @@ def main():
         with st.spinner("📊 비교 차트를 생성하는 중..."):
             direction_chart = create_direction_compare_chart(
                 direction_compare_df, 
-                time_slots, 
                 selected_station, 
                 selected_day
             )
         
         if direction_chart is not None:
-            st.altair_chart(direction_chart, use_container_width=True)
+            st.vega_lite_chart(direction_chart, use_container_width=True)
             st.caption("💡 선택한 역의 양방향 혼잡도를 비교합니다. 출근/퇴근 시간대에 방향별 차이가 명확히 나타납니다.")
         else:
             st.info("방향별 비교 데이터가 없습니다.")
@@ -937,7 +1421,7 @@ def main():
         # 다중 호선 데이터 필터링 (캐싱을 위해 tuple로 변환)
         with st.spinner(f"🚇 {len(compare_lines)}개 호선 데이터를 비교하는 중..."):
             line_compare_df = filter_for_line_compare(
-                df, 
+                line_agg, 
                 selected_day, 
                 tuple(compare_lines), 
                 selected_direction,
@@ -945,21 +1429,23 @@ def main():
                 end_time
             )
         
-        if len(line_compare_df) > 0:
-            # 대용량 비교 데이터 경고
-            if len(line_compare_df) > 5000:
-                st.info(f"ℹ️ {len(line_compare_df):,}개 레코드를 집계하여 차트를 생성합니다.")
+        # 집계 테이블 한 행은 여러 역의 원본 레코드를 대표
+        record_count = int(line_compare_df['records'].sum())
+        
+        if record_count > 0:
+            # 대용량 비교 데이터 안내
+            if record_count > 5000:
+                st.info(f"ℹ️ {record_count:,}개 레코드를 집계하여 차트를 생성합니다.")
             
             with st.spinner("📊 호선별 비교 차트를 생성하는 중..."):
                 line_chart = create_line_compare_chart(
                     line_compare_df, 
-                    time_slots, 
                     selected_direction, 
                     selected_day
                 )
             
             if line_chart is not None:
-                st.altair_chart(line_chart, use_container_width=True)
+                st.vega_lite_chart(line_chart, use_container_width=True)
                 
                 # 추가 정보 표시
                 col_caption1, col_caption2 = st.columns(2)
@@ -979,106 +1465,7 @@ def main():
     # ========================================================================
     # TOP 구간 테이블 + CSV 다운로드 (페이즈 3: 기준 선택)
     # ========================================================================
-    st.markdown("### 🔝 혼잡 TOP 10 구간")
-    
-    # TOP N 정렬 기준 선택
-    col_top1, col_top2 = st.columns([2, 1])
-    
-    with col_top1:
-        top_criteria = st.radio(
-            "정렬 기준",
-            options=["피크 (최대)", "평균", "특정 시간대"],
-            horizontal=True,
-            help="혼잡 TOP 구간을 선택한 기준으로 정렬합니다."
-        )
-    
-    with col_top2:
-        if top_criteria == "특정 시간대":
-            specific_time = st.selectbox(
-                "시간대 선택",
-                options=time_slots,
-                index=time_slots.index("08:00") if "08:00" in time_slots else 0
-            )
-    
-    # 혼잡 TOP 10 구간 계산
-    top_n = 10
-    
-    if top_criteria == "피크 (최대)":
-        # 기존 방식: 각 시간대별 최대값
-        top_df = filtered_df.dropna(subset=['congestion']).nlargest(top_n, 'congestion')[
-            ['time_slot', 'station_name', 'line', 'direction', 'congestion']
-        ].reset_index(drop=True)
-    
-    elif top_criteria == "평균":
-        # 역/방향별 평균 혼잡도로 정렬
-        avg_df = filtered_df.dropna(subset=['congestion']).groupby(
-            ['station_name', 'line', 'direction'], as_index=False
-        )['congestion'].mean()
-        avg_df = avg_df.rename(columns={'congestion': 'avg_congestion'})
-        top_df = avg_df.nlargest(top_n, 'avg_congestion')[
-            ['station_name', 'line', 'direction', 'avg_congestion']
-        ].reset_index(drop=True)
-        top_df = top_df.rename(columns={'avg_congestion': 'congestion'})
-        top_df.insert(1, 'time_slot', '평균')
-    
-    else:  # 특정 시간대
-        # 특정 시간대의 혼잡도로 정렬
-        time_specific_df = filtered_df[
-            filtered_df['time_slot'] == specific_time
-        ].dropna(subset=['congestion'])
-        top_df = time_specific_df.nlargest(top_n, 'congestion')[
-            ['time_slot', 'station_name', 'line', 'direction', 'congestion']
-        ].reset_index(drop=True)
-    
-    # 빈 결과 처리
-    if len(top_df) == 0:
-        st.info("선택한 조건에 해당하는 혼잡 데이터가 없습니다.")
-    else:
-        # 순위 추가
-        top_df.insert(0, '순위', range(1, len(top_df) + 1))
-        
-        # 혼잡 등급 및 이모지 추가
-        top_df['혼잡등급'] = top_df['congestion'].apply(get_congestion_emoji)
-        
-        # 컬럼명 한글화
-        top_df_display = top_df.rename(columns={
-            '순위': '순위',
-            'time_slot': '시간대',
-            'station_name': '역명',
-            'line': '호선',
-            'direction': '방향',
-            'congestion': '혼잡도',
-            '혼잡등급': '등급'
-        })
-        
-        # 혼잡도에 색상 적용하는 함수
-        def color_congestion(val):
-            if pd.isna(val):
-                return ''
-            color = get_congestion_color(val)
-            return f'background-color: {color}33; color: {color}; font-weight: bold;'
-        
-        # 스타일 적용
-        styled_df = top_df_display.style.applymap(
-            color_congestion,
-            subset=['혼잡도']
-        )
-        
-        st.dataframe(
-            styled_df,
-            use_container_width=True,
-            hide_index=True
-        )
-        
-        # CSV 다운로드 버튼
-        csv = top_df_display.to_csv(index=False).encode('utf-8-sig')
-        st.download_button(
-            label="📥 CSV 다운로드",
-            data=csv,
-            file_name=f"혼잡도_TOP{top_n}_{selected_station}_{selected_day}.csv",
-            mime="text/csv",
-            help="상위 혼잡 구간 데이터를 CSV 파일로 다운로드합니다."
-        )
+    render_top_congestion_table(filtered_df, time_slots, selected_station, selected_day)
     
     # ========================================================================
     # 추가 정보 (접을 수 있음)